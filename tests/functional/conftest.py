@@ -7,6 +7,18 @@ Environment variables
 
 test_preserve_model:
 if set, the testing model won't be torn down at the end of the testing session
+
+Parallel runs
+-------------
+
+The tests can be spread over pytest-xdist workers, each using its own model:
+
+    pytest -n 2 --dist loadgroup tests/functional
+
+All tests for one series are grouped onto the same worker. Kept models are not
+supported under pytest-xdist: loadgroup does not pin a series to the same worker
+across runs, so PYTEST_MODEL and PYTEST_KEEP_MODEL are ignored and every worker
+creates and destroys its own random model.
 """
 
 import asyncio
@@ -43,16 +55,24 @@ async def controller():
     await _controller.disconnect()
 
 
+def pytest_collection_modifyitems(config, items):
+    """Keep the tests for each series together on one pytest-xdist worker."""
+    for item in items:
+        params = getattr(item, "callspec", None) and item.callspec.params
+        if params and "series" in params:
+            item.add_marker(pytest.mark.xdist_group(name=params["series"]))
+
+
 @pytest.fixture(scope="module")
-async def model(controller):
+async def model(controller, request):
     """Return the model for the test."""
-    model_name = os.getenv("PYTEST_MODEL")
+    worker_id = getattr(request.config, "workerinput", {}).get("workerid")
+    # Kept models are not supported under pytest-xdist
+    model_name = None if worker_id else os.getenv("PYTEST_MODEL")
     if model_name:
         # Reuse existing model
         _model = Model()
-        full_name = "{}:{}".format(
-            controller.controller_name, os.getenv("PYTEST_MODEL")
-        )
+        full_name = "{}:{}".format(controller.controller_name, model_name)
         try:
             await _model.connect(full_name)
         except JujuConnectionError:
@@ -64,7 +84,8 @@ async def model(controller):
             )
     else:
         # Create a new random model
-        model_name = "functest-{}".format(str(uuid.uuid4())[-12:])
+        prefix = "functest-{}".format(worker_id) if worker_id else "functest"
+        model_name = "{}-{}".format(prefix, str(uuid.uuid4())[-12:])
         _model = await controller.add_model(
             model_name,
             cloud_name=os.getenv("PYTEST_CLOUD_NAME"),
@@ -76,7 +97,7 @@ async def model(controller):
         await asyncio.sleep(1)
     yield _model
     await _model.disconnect()
-    if not os.getenv("PYTEST_KEEP_MODEL"):
+    if worker_id or not os.getenv("PYTEST_KEEP_MODEL"):
         await controller.destroy_model(model_name)
         while model_name in await controller.list_models():
             await asyncio.sleep(1)
@@ -87,3 +108,20 @@ async def jujutools(controller, model):
     """Create a fixture from a new instance of the JujuTools helper class."""
     tools = JujuTools(controller, model)
     return tools
+
+
+@pytest.fixture(scope="module")
+async def statuses(model):
+    """Return application statuses kept up to date from the model's delta stream."""
+    _statuses = {name: app.status for name, app in model.applications.items()}
+
+    async def _on_change(delta, old, new, model):
+        if delta.type == "remove":
+            _statuses.pop(new.name, None)
+        else:
+            _statuses[new.name] = new.status
+
+    model.add_observer(_on_change, entity_type="application")
+    # libjuju only holds observer callbacks weakly, so yielding keeps _on_change
+    # registered for the module and releasing it on teardown unregisters it
+    yield _statuses
@@ -1,11 +1,125 @@
 """Fixtures for functional testing of Juju charms."""
+import asyncio
 import base64
+import logging
 import pickle
+import random
 
 import juju
 
 # from juju.errors import JujuError
 
+log = logging.getLogger(__name__)
+
+
+async def wait_for(predicate, initial=1.0, cap=5.0):
+    """
+    Wait until a predicate holds.
+
+    The predicate is polled with a jittered exponential backoff rather than on
+    a fixed interval, so long deploys don't keep the test loop busy.
+
+    :param predicate: Callable returning True once the wait is over
+    :param initial: First backoff delay in seconds
+    :param cap: Maximum backoff delay in seconds
+    """
+    delay = initial
+    while not predicate():
+        await asyncio.sleep(random.uniform(0, delay))
+        delay = min(delay * 2, cap)
+
+
+async def gather_or_cancel(*aws):
+    """
+    Run awaitables concurrently, cancelling the rest as soon as one fails.
+
+    :param aws: Coroutines or futures to run
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def status_in(obj, accept, attr="status"):
+    """
+    Return a predicate checking whether an entity reports an accepted status.
+
+    The accepted statuses are frozen once, so the predicate can be polled
+    repeatedly without rebuilding the comparison.
+
+    :param obj: Application or unit to check
+    :param accept: Collection of accepted status values
+    :param attr: Name of the status attribute to check, e.g. agent_status
+    """
+    accept = frozenset(accept)
+
+    def _predicate():
+        return getattr(obj, attr) in accept
+
+    return _predicate
+
+
+async def wait_status(obj, accept, attr="status", initial=1.0, cap=5.0):
+    """
+    Wait until a Juju entity reports one of the accepted statuses.
+
+    :param obj: Application or unit to watch
+    :param accept: Collection of status values that end the wait
+    :param attr: Name of the status attribute to check, e.g. agent_status
+    :param initial: First backoff delay in seconds
+    :param cap: Maximum backoff delay in seconds
+    """
+    await wait_for(status_in(obj, accept, attr=attr), initial=initial, cap=cap)
+
+
+async def wait_until_success(obj, ok, attr="status"):
+    """
+    Wait until a Juju entity reports the expected status, failing fast on error.
+
+    :param obj: Application or unit to watch
+    :param ok: Status value that ends the wait successfully
+    :param attr: Name of the status attribute to check, e.g. agent_status
+    :raises AssertionError: if the entity enters the error state
+    """
+    await wait_status(obj, {ok, "error"}, attr=attr)
+    if getattr(obj, attr) == "error":
+        raise AssertionError("{} entered error state".format(obj.name))
+
+
+def snapshot_statuses(statuses, names):
+    """
+    Return the current status of several applications in one read.
+
+    :param statuses: Status cache as returned by the statuses fixture
+    :param names: Names of the applications to read
+    """
+    return {name: statuses.get(name) for name in names}
+
+
+async def wait_statuses(statuses, expected):
+    """
+    Wait until several applications each report one of their accepted statuses.
+
+    :param statuses: Status cache as returned by the statuses fixture
+    :param expected: Dictionary mapping application names to accepted statuses
+    :raises AssertionError: as soon as any of the applications enters the error state
+    """
+    expected = {name: frozenset(accept) for name, accept in expected.items()}
+
+    def _settled():
+        snapshot = snapshot_statuses(statuses, expected)
+        for name, status in snapshot.items():
+            if status == "error":
+                raise AssertionError("{} entered error state".format(name))
+        return all(snapshot[name] in accept for name, accept in expected.items())
+
+    await wait_for(_settled)
+
 
 class JujuTools:
     """Provide fixtures as a single class for ease of use."""
@@ -91,7 +205,7 @@ class JujuTools:
         """
         imports = "import os;"
         python_cmd = 'os.stat("{}")'.format(path)
-        print("Calling remote cmd: " + python_cmd)
+        log.debug("Calling remote cmd: %s", python_cmd)
         return await self.remote_object(imports, python_cmd, target)
 
     async def file_contents(self, path, target):
@@ -103,7 +217,7 @@ class JujuTools:
         """
         cmd = "cat {}".format(path)
         result = await self.run_command(cmd, target)
-        print(result)
+        log.debug("Result of %s: %r", cmd, result)
         return result["Stdout"]
 
     async def service_status(self, service, target):
@@ -140,17 +254,19 @@ class JujuTools:
         """
         original_config = await self.convert_config(await app.get_config())
         unit0 = app.units[0]
+        executing = status_in(unit0, {"executing"}, attr="agent_status")
+        idle = status_in(unit0, {"idle"}, attr="agent_status")
         await app.set_config(config)
         # Wait for config to apply
-        await self.model.block_until(lambda: unit0.agent_status == "executing")
-        await self.model.block_until(lambda: unit0.agent_status == "idle")
+        await self.model.block_until(executing)
+        await self.model.block_until(idle)
         # Check the results
         for unit in app.units:
             for test in tests:
                 path = test.get("path")
                 contents = await self.file_contents(path, unit)
-                print("Checking: {}".format(path))
-                print("Contents: {}".format(contents))
+                log.debug("Checking: %s", path)
+                log.debug("Contents: %s", contents)
                 try:
                     expected_contents = test.get("contains", None)
                     if expected_contents:
@@ -162,13 +278,11 @@ class JujuTools:
                     # Reset configuration
                     await app.set_config(original_config)
                     # Wait for config to apply
-                    await self.model.block_until(
-                        lambda: unit0.agent_status == "executing"
-                    )
-                    await self.model.block_until(lambda: unit0.agent_status == "idle")
+                    await self.model.block_until(executing)
+                    await self.model.block_until(idle)
                     raise
         # Reset configuration
         await app.set_config(original_config)
         # Wait for config to apply
-        await self.model.block_until(lambda: unit0.agent_status == "executing")
-        await self.model.block_until(lambda: unit0.agent_status == "idle")
+        await self.model.block_until(executing)
+        await self.model.block_until(idle)
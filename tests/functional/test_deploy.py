@@ -1,7 +1,9 @@
 """Test deployment and configuration of GitLab."""
-import asyncio
 import os
 import stat
+from types import SimpleNamespace
+
+from juju_tools import gather_or_cancel, status_in, wait_statuses, wait_until_success
 
 import pytest
 
@@ -13,10 +15,8 @@ series = [
     "bionic",
     "focal",
 ]
-sources = [
-    ("local", "{}/builds/gitlab".format(juju_repository)),
-    # ("jujucharms", "cs:~pirate-charmers/gitlab"),
-]
+source = ("local", "{}/builds/gitlab".format(juju_repository))
+metadata_mode = "-rw-r--r--"
 
 
 # Custom fixtures
@@ -26,230 +26,220 @@ def series(request):
     return request.param
 
 
-@pytest.fixture(params=sources, ids=[s[0] for s in sources])
-def source(request):
-    """Return the source of the app in test."""
-    return request.param
+@pytest.fixture
+def names(series):
+    """Return the application names used for the current series."""
+    return SimpleNamespace(
+        app="gitlab-{}-{}".format(series, source[0]),
+        redis="gitlab-redis-{}".format(series),
+        pgsql="gitlab-pgsql-{}".format(series),
+        pgsql12="gitlab-pgsql12-{}".format(series),
+        mysql="gitlab-mysql-{}".format(series),
+        haproxy="gitlab-haproxy-{}".format(series),
+    )
+
+
+@pytest.fixture(scope="module")
+def kept_deployments():
+    """Return the per-series record of deployments found in a kept model."""
+    return {}
+
+
+@pytest.fixture
+def reused(model, series, names, kept_deployments):
+    """Return whether a kept model already held the full deployment before this run."""
+    if series not in kept_deployments:
+        present = {name: name in model.applications for name in vars(names).values()}
+        if any(present.values()) and not all(present.values()):
+            missing = sorted(name for name, found in present.items() if not found)
+            pytest.fail(
+                "Kept model holds a partial {} deployment, missing: {}".format(
+                    series, ", ".join(missing)
+                )
+            )
+        kept_deployments[series] = all(present.values())
+    return kept_deployments[series]
+
+
+@pytest.fixture(autouse=True)
+def skip_if_reused(request):
+    """Skip tests that expect a freshly deployed model when the deployment was reused."""
+    if request.node.get_closest_marker("fresh_model") and request.getfixturevalue("reused"):
+        pytest.skip("GitLab deployment reused from a kept model")
 
 
 @pytest.fixture
-async def app(model, series, source):
+async def app(model, names):
     """Return the Juju application for the current test."""
-    app_name = "gitlab-{}-{}".format(series, source[0])
-    return model.applications[app_name]
+    return model.applications[names.app]
 
 
-@pytest.mark.timeout(30)
-async def test_gitlab_deploy(model, series, source, request):
-    """Start the deploy of the GitLab charm across supported series."""
-    application_name = "gitlab-{}-{}".format(series, source[0])
-    cmd = "juju deploy {} -m {} --series {} {}".format(
-        source[1], model.info.name, series, application_name
+async def deploy_once(model, entity_url, application_name, **kwargs):
+    """Deploy an application, reusing it if a kept model already has it."""
+    if application_name in model.applications:
+        return model.applications[application_name]
+    return await model.deploy(entity_url, application_name=application_name, **kwargs)
+
+
+@pytest.fixture
+async def dependencies(model, series, names):
+    """
+    Start the deploys of the applications GitLab relates to and return them by name.
+
+    The deploys are started concurrently and not waited on, so they settle alongside
+    GitLab; test_initial_deploy_status waits for all of them together.
+    """
+    redis, pgsql, pgsql12, mysql = await gather_or_cancel(
+        deploy_once(model, "cs:~redis-charmers/redis", names.redis, series="xenial"),
+        deploy_once(model, "cs:postgresql", names.pgsql, series="bionic"),
+        deploy_once(model, "cs:postgresql", names.pgsql12, config={"version": "12"}, series=series),
+        deploy_once(model, "cs:mysql", names.mysql, series="xenial"),
     )
-    if request.node.get_closest_marker("xfail"):
-        cmd += " --force"
-    await asyncio.create_subprocess_shell(cmd)
+    return {"redis": redis, "pgsql": pgsql, "pgsql12": pgsql12, "mysql": mysql}
 
-    app = await model._wait_for_new("application", application_name)
-    await model.block_until(lambda: app.status == "waiting")
 
+@pytest.fixture
+def redis_app(dependencies):
+    """Return the Redis application related to GitLab."""
+    return dependencies["redis"]
 
-@pytest.mark.timeout(30)
-async def test_redis_deploy(model, series, app, request):
-    """Create a Redis deployment for testing relation to GitLab."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
-
-    application_name = "gitlab-redis-{}".format(series)
-    cmd = "juju deploy cs:~redis-charmers/redis -m {} --series xenial {}".format(
-        model.info.name, application_name
-    )
-    await asyncio.create_subprocess_shell(cmd)
-    await model._wait_for_new("application", application_name)
 
+@pytest.fixture
+def pgsql_app(dependencies):
+    """Return the PostgreSQL application related to GitLab."""
+    return dependencies["pgsql"]
 
-@pytest.mark.timeout(30)
-async def test_pgsql_deploy(model, series, app, request):
-    """Create a PostgreSQL deployment for testing relation to GitLab."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
-
-    application_name = "gitlab-pgsql-{}".format(series)
-    cmd = "juju deploy cs:postgresql -m {} --series bionic {}".format(
-        model.info.name, application_name
-    )
-    await asyncio.create_subprocess_shell(cmd)
-    await model._wait_for_new("application", application_name)
 
+@pytest.fixture
+def mysql_app(dependencies):
+    """Return the MySQL application related to GitLab."""
+    return dependencies["mysql"]
 
-@pytest.mark.timeout(30)
-async def test_pgsql12_deploy(model, series, app, request):
-    """Create a PostgreSQL12.x deployment for testing relation to GitLab."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
-
-    application_name = "gitlab-pgsql12-{}".format(series)
-    cmd = "juju deploy cs:postgresql -m {} --config version=12 --series {} {}".format(
-        model.info.name, series, application_name
+
+@pytest.fixture
+def unit_metadata_path(app):
+    """Return the path of the charm metadata on the first GitLab unit."""
+    return "/var/lib/juju/agents/unit-{}/charm/metadata.yaml".format(
+        app.units[0].entity_id.replace("/", "-")
     )
-    await asyncio.create_subprocess_shell(cmd)
-    await model._wait_for_new("application", application_name)
 
 
+@pytest.fixture
+def haproxy_app(model, names):
+    """Return the haproxy application fronting GitLab."""
+    return model.applications[names.haproxy]
+
+
+@pytest.mark.deploy
 @pytest.mark.timeout(30)
-async def test_mysql_deploy(model, series, app, request):
-    """Create a MySQL deployment for testing relation to GitLab."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
-
-    application_name = "gitlab-mysql-{}".format(series)
-    cmd = "juju deploy cs:mysql -m {} --series xenial {}".format(
-        model.info.name, application_name
+async def test_gitlab_deploy(model, series, names, reused, request):
+    """Start the deploy of the GitLab charm across supported series."""
+    if reused:
+        # Reuse the deployment from a kept model
+        assert model.applications[names.app].status != "error"
+        return
+    app = await model.deploy(
+        source[1],
+        application_name=names.app,
+        series=series,
+        force=bool(request.node.get_closest_marker("xfail")),
     )
-    await asyncio.create_subprocess_shell(cmd)
-    await model._wait_for_new("application", application_name)
+    await model.block_until(status_in(app, {"waiting"}))
 
 
+@pytest.mark.deploy
+@pytest.mark.timeout(60)
+async def test_dependencies_deploy(dependencies):
+    """Start the deploys of Redis, PostgreSQL and MySQL for testing relations to GitLab."""
+    for dependency in dependencies.values():
+        assert dependency.status != "error"
+
+
+@pytest.mark.deploy
 @pytest.mark.timeout(30)
-async def test_haproxy_deploy(model):
+async def test_haproxy_deploy(model, names):
     """Deploy haproxy for testing."""
-    cmd = "juju deploy cs:~pirate-charmers/haproxy -m {}".format(model.info.name)
-    await asyncio.create_subprocess_shell(cmd)
-    await model._wait_for_new("application", "haproxy")
+    await deploy_once(model, "cs:~pirate-charmers/haproxy", names.haproxy)
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(300)
-async def test_initial_deploy_status(model, app, request, series):
+async def test_initial_deploy_status(app, redis_app, pgsql_app, mysql_app, statuses):
     """Wait for the deployment of GitLab to complete and test the status is blocked prior to relations."""
-    unit = app.units[0]
-    await model.block_until(
-        lambda: unit.agent_status == "idle" or unit.agent_status == "error"
+    await wait_until_success(app.units[0], "idle", attr="agent_status")
+    await wait_statuses(
+        statuses,
+        {
+            pgsql_app.name: {"active"},
+            mysql_app.name: {"active"},
+            redis_app.name: {"active"},
+            app.name: {"blocked"},
+        },
     )
-    pgsql = model.applications["gitlab-pgsql-{}".format(series)]
-    mysql = model.applications["gitlab-mysql-{}".format(series)]
-    redis = model.applications["gitlab-redis-{}".format(series)]
-    await model.block_until(lambda: pgsql.status == "active" or app.status == "error")
-    await model.block_until(lambda: mysql.status == "active" or app.status == "error")
-    await model.block_until(lambda: redis.status == "active" or app.status == "error")
-    await model.block_until(lambda: app.status == "blocked" or app.status == "error")
-    assert unit.agent_status != "error"
-    assert pgsql.status != "error"
-    assert mysql.status != "error"
-    assert redis.status != "error"
-    assert app.status != "error"
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(30)
-async def test_redis_relate(model, series, app, request):
+async def test_redis_relate(model, app, redis_app, statuses):
     """Test relating Redis to GitLab."""
-    application_name = "gitlab-redis-{}".format(series)
-    redis = model.applications[application_name]
-    await model.add_relation("{}:redis".format(app.name), application_name)
-    await model.block_until(lambda: redis.status == "active" or redis.status == "error")
-    await model.block_until(lambda: app.status == "blocked" or app.status == "error")
-    assert redis.status != "error"
-    assert app.status != "error"
+    await model.add_relation("{}:redis".format(app.name), redis_app.name)
+    await wait_statuses(statuses, {redis_app.name: {"active"}, app.name: {"blocked"}})
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(30)
-async def test_mysql_relate(model, series, app, request):
+async def test_mysql_relate(model, app, mysql_app, statuses):
     """Test relating MySQL to GitLab, expect failure due to removal of MySQL support."""
-    application_name = "gitlab-mysql-{}".format(series)
-    sql = model.applications[application_name]
-    await model.add_relation("{}:db".format(app.name), application_name)
-    await model.block_until(lambda: sql.status == "active" or sql.status == "error")
-    await model.block_until(lambda: app.status == "active" or app.status == "blocked")
-    assert sql.status != "error"
-    assert app.status != "error"
+    await model.add_relation("{}:db".format(app.name), mysql_app.name)
+    await wait_statuses(statuses, {mysql_app.name: {"active"}, app.name: {"active", "blocked"}})
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(60)
 async def test_gitlab_deploy_status_mysql(model, app, request):
     """Wait for the deployment of GitLab to complete and test the status is blocked prior to relations."""
-    unit = app.units[0]
-    await model.block_until(
-        lambda: unit.agent_status == "idle" or unit.agent_status == "error"
-    )
-    await model.block_until(lambda: app.status == "blocked" or app.status == "error")
-    assert unit.agent_status != "error"
-    assert app.status != "error"
+    await wait_until_success(app.units[0], "idle", attr="agent_status")
+    await wait_until_success(app, "blocked")
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(30)
-async def test_pgsql_relate(model, series, app, request):
+async def test_pgsql_relate(model, app, pgsql_app, statuses):
     """Test relating PostgreSQL to GitLab."""
-    application_name = "gitlab-pgsql-{}".format(series)
-    sql = model.applications[application_name]
     await model.add_relation(
-        "{}:pgsql".format(app.name), "{}:db-admin".format(application_name)
+        "{}:pgsql".format(app.name), "{}:db-admin".format(pgsql_app.name)
     )
-    await model.block_until(lambda: sql.status == "active" or sql.status == "error")
-    await model.block_until(lambda: app.status == "blocked" or app.status == "error")
-    assert sql.status != "error"
-    assert app.status != "error"
+    await wait_statuses(statuses, {pgsql_app.name: {"active"}, app.name: {"blocked"}})
 
 
 @pytest.mark.timeout(60)
 async def test_migrate_action(app):
     """Test migrate execution against deployed GitLab instances for the local charm."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
     unit = app.units[0]
     action = await unit.run_action("migratedb")
     action = await action.wait()
     assert action.status == "completed"
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(30)
 async def test_gitlab_deploy_status_migrate(model, app, request):
     """Wait for the deployment of GitLab to complete and test the status is blocked prior to relations."""
-    unit = app.units[0]
-    await model.block_until(
-        lambda: unit.agent_status == "idle" or unit.agent_status == "error"
-    )
-    await model.block_until(lambda: app.status == "blocked" or app.status == "error")
-    assert unit.agent_status != "error"
-    assert app.status != "error"
+    await wait_until_success(app.units[0], "idle", attr="agent_status")
+    await wait_until_success(app, "blocked")
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(30)
-async def test_mysql_unrelate(model, series, app, request):
+async def test_mysql_unrelate(app, mysql_app, statuses):
     """Test removing MySQL relation to GitLab, unit should configure and enter active state."""
-    application_name = "gitlab-mysql-{}".format(series)
-    sql = model.applications[application_name]
-    await sql.remove_relation("{}:db".format(application_name), "{}:db".format(app.name))
-    await model.block_until(lambda: sql.status == "active" or sql.status == "error")
-    await model.block_until(lambda: app.status == "active" or app.status == "error")
-    assert sql.status != "error"
-    assert app.status != "error"
-
-
-@pytest.mark.timeout(120)
-async def test_charm_upgrade(model, app, request):
-    """Test upgrade of the juju charm store deployed GitLab to the local charm."""
-    if app.name.endswith("local"):
-        pytest.skip("No need to upgrade the local deploy")
-
-    unit = app.units[0]
-    await model.block_until(lambda: unit.agent_status == "idle")
-    await asyncio.create_subprocess_shell(
-        "juju upgrade-charm --switch={} -m {} {}".format(
-            sources[0][1], model.info.name, app.name
-        )
-    )
-    await model.block_until(
-        lambda: unit.agent_status == "idle" or unit.agent_status == "error"
-    )
-    await model.block_until(lambda: app.status == "active" or app.status == "error")
-    assert unit.agent_status != "error"
-    assert app.status != "error"
+    await mysql_app.remove_relation("{}:db".format(mysql_app.name), "{}:db".format(app.name))
+    await wait_statuses(statuses, {mysql_app.name: {"active"}, app.name: {"active"}})
 
 
 @pytest.mark.timeout(30)
 async def test_reconfigure_action(app):
     """Test action execution against deployed GitLab instances for the local charm."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
     unit = app.units[0]
     action = await unit.run_action("reconfigure")
     action = await action.wait()
@@ -259,8 +249,6 @@ async def test_reconfigure_action(app):
 @pytest.mark.timeout(30)
 async def test_run_command(app, jujutools):
     """Test command execution against deployed GitLab instances for the local charm."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
     unit = app.units[0]
     cmd = "echo test"
     results = await jujutools.run_command(cmd, unit)
@@ -269,16 +257,10 @@ async def test_run_command(app, jujutools):
 
 
 @pytest.mark.timeout(30)
-async def test_juju_file_stat(app, jujutools):
+async def test_juju_file_stat(app, unit_metadata_path, jujutools):
     """Test the ability to retrieve the status of a file from a deployed unit."""
-    if app.name.endswith("jujucharms"):
-        pytest.skip("No need to test the charm deploy")
-    unit = app.units[0]
-    path = "/var/lib/juju/agents/unit-{}/charm/metadata.yaml".format(
-        unit.entity_id.replace("/", "-")
-    )
-    fstat = await jujutools.file_stat(path, unit)
-    assert stat.filemode(fstat.st_mode) == "-rw-r--r--"
+    fstat = await jujutools.file_stat(unit_metadata_path, app.units[0])
+    assert stat.filemode(fstat.st_mode) == metadata_mode
     assert fstat.st_uid == 0
     assert fstat.st_gid == 0
 
@@ -293,22 +275,21 @@ async def test_backup_action(app):
     assert action.status == "completed"
 
 
+@pytest.mark.fresh_model
 @pytest.mark.timeout(30)
-async def test_add_relation(model, app, series, source):
+async def test_add_relation(model, app, haproxy_app, series):
     """Add relation for reverseproxy."""
-    haproxy = model.applications['haproxy']
     config = {'external_url': "https://{}-{}.example.com".format(series, source[0]),
               'proxy_via_ip': "true"}
     await app.set_config(config)
-    await app.add_relation('reverseproxy', 'haproxy:reverseproxy')
-    await model.block_until(lambda: haproxy.status == 'maintenance')
-    await model.block_until(lambda: haproxy.status == 'active')
+    await app.add_relation('reverseproxy', '{}:reverseproxy'.format(haproxy_app.name))
+    await model.block_until(status_in(haproxy_app, {'maintenance'}))
+    await model.block_until(status_in(haproxy_app, {'active'}))
 
 
-async def test_reverseproxy_config(model, app, jujutools):
+async def test_reverseproxy_config(app, haproxy_app, jujutools):
     """Check haproxy config includes gitlab."""
-    haproxy = model.applications['haproxy']
-    config = await jujutools.file_contents("/etc/haproxy/haproxy.cfg", haproxy.units[0])
+    config = await jujutools.file_contents("/etc/haproxy/haproxy.cfg", haproxy_app.units[0])
     public_address = app.units[0].public_address
     assert "{}:80".format(public_address) in config
     assert "{}:22".format(public_address) in config